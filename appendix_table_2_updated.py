@@ -22,55 +22,49 @@ import pandas as pd
 import numpy as np
 import os
 
-def calculate_prevalence_ci(group):
+def prevalence_ci_from_sums(sums):
     '''
     Calculates weighted smoking prevalence, effective sample size (n_eff),
-    and the 95% confidence interval (CI) for a given data group.
+    and the 95% confidence interval (CI) from per-group weight sums.
 
     Args:
-        group (pd.DataFrame): DataFrame subgroup with _LLCPWT (weights) and
-                              currentsmoker (0 or 1 indicator).
+        sums (pd.DataFrame): One row per group with '_LLCPWT' (sum of weights),
+                             'ws' (sum of weight * currentsmoker) and
+                             'w2' (sum of squared weights).
 
     Returns:
-        pd.Series: Contains 'prevalence', 'n_eff' (effective sample size),
-                   'ci_lower' (CI lower bound), 'ci_upper' (CI upper bound),
-                   and 'prevalence_ci_str' (formatted string for prevalence and CI).
+        pd.DataFrame: Same index as `sums`, with 'prevalence', 'n_eff'
+                      (effective sample size), 'ci_lower' (CI lower bound),
+                      'ci_upper' (CI upper bound) and 'prevalence_ci_str'
+                      (formatted string for prevalence and CI).
     '''
-    weighted_smokers = (group['_LLCPWT'] * group['currentsmoker']).sum()
-    total_weight = group['_LLCPWT'].sum()
-
-    # Handle cases where the group is empty or weights sum to zero
-    if total_weight == 0:
-        return pd.Series({
-            'prevalence': np.nan,
-            'n_eff': 0,
-            'ci_lower': np.nan,
-            'ci_upper': np.nan,
-            'prevalence_ci_str': 'N/A'
-        })
-
-    prevalence = weighted_smokers / total_weight
-
-    # Calculate effective sample size (Kish's formula for weighted data)
-    sum_weights_sq = (group['_LLCPWT']**2).sum()
-    if sum_weights_sq == 0:
-        n_eff = 0
-    else:
-        n_eff = (total_weight**2) / sum_weights_sq
-
-    # Calculate 95% CI
-    if n_eff == 0 or not (0 <= prevalence <= 1):
-        ci_lower = np.nan
-        ci_upper = np.nan
-        prevalence_ci_str = f"{prevalence*100:.1f}% (N/A)" if not np.isnan(prevalence) else "N/A"
-    else:
-        p_for_ci = max(0, min(1, prevalence))
-        margin_of_error = 1.96 * np.sqrt((p_for_ci * (1 - p_for_ci)) / n_eff)
-        ci_lower = max(0, prevalence - margin_of_error)
-        ci_upper = min(1, prevalence + margin_of_error)
-        prevalence_ci_str = f"{prevalence*100:.1f}% ({ci_lower*100:.1f}% - {ci_upper*100:.1f}%)"
-
-    return pd.Series({
+    total_weight = sums['_LLCPWT']
+    sum_weights_sq = sums['w2']
+
+    # Groups whose weights sum to zero have no prevalence estimate
+    prevalence = (sums['ws'] / total_weight).where(total_weight != 0)
+
+    # Effective sample size (Kish's formula for weighted data)
+    n_eff = (total_weight**2 / sum_weights_sq).where((total_weight != 0) & (sum_weights_sq != 0), 0)
+
+    # 95% CI, only where n_eff is positive and prevalence is a valid proportion
+    has_ci = (n_eff != 0) & prevalence.between(0, 1)
+    p_for_ci = prevalence.clip(0, 1)
+    margin_of_error = 1.96 * np.sqrt((p_for_ci * (1 - p_for_ci)) / n_eff.where(has_ci))
+    ci_lower = (prevalence - margin_of_error).clip(lower=0)
+    ci_upper = (prevalence + margin_of_error).clip(upper=1)
+
+    # Format each column once in bulk, then assemble the strings column-wise
+    prevalence_txt, lower_txt, upper_txt = (
+        pd.Series(np.char.mod('%.1f', (values * 100).to_numpy(dtype=np.float64)), index=sums.index)
+        for values in (prevalence, ci_lower, ci_upper)
+    )
+    prevalence_ci_str = (prevalence_txt + '% (' + lower_txt + '% - ' + upper_txt + '%)').where(
+        has_ci,
+        (prevalence_txt + '% (N/A)').where(prevalence.notna(), 'N/A')
+    )
+
+    return pd.DataFrame({
         'prevalence': prevalence,
         'n_eff': n_eff,
         'ci_lower': ci_lower,
@@ -78,6 +72,46 @@ def calculate_prevalence_ci(group):
         'prevalence_ci_str': prevalence_ci_str
     })
 
+def sum_by_group(df, keys, value_cols):
+    '''
+    Sums columns within groups by accumulating flat NumPy arrays on integer
+    group codes, bypassing the pandas groupby machinery.
+
+    Args:
+        df (pd.DataFrame): Data containing the key and value columns.
+        keys (list): Grouping columns. Rows with a missing key are excluded,
+                     as with groupby's default dropna=True.
+        value_cols (list): Numeric columns to sum.
+
+    Returns:
+        pd.DataFrame: One row per observed key combination (in order of first
+                      appearance), indexed by `keys`, with one column per
+                      entry in `value_cols`.
+    '''
+    # Factorize each key, then fold the per-key codes into one integer code
+    level_codes, level_uniques = zip(*(pd.factorize(df[key]) for key in keys))
+    complete = np.logical_and.reduce([codes >= 0 for codes in level_codes])
+    # A slice keeps plain views when no row needs dropping (the usual case)
+    rows = slice(None) if complete.all() else complete
+    combined = np.zeros(int(complete.sum()), dtype=np.int64)
+    for codes, uniques in zip(level_codes, level_uniques):
+        combined = combined * len(uniques) + codes[rows]
+    group_ids, combined_uniques = pd.factorize(combined)
+
+    # Decode each group's combined code back into its key values
+    index_arrays = []
+    remainder = combined_uniques
+    for uniques in reversed(level_uniques):
+        remainder, codes = np.divmod(remainder, len(uniques))
+        index_arrays.insert(0, uniques.take(codes))
+    index = pd.MultiIndex.from_arrays(index_arrays, names=keys)
+
+    n_groups = len(combined_uniques)
+    return pd.DataFrame({
+        col: np.bincount(group_ids, weights=df[col].to_numpy(dtype=np.float64)[rows], minlength=n_groups)
+        for col in value_cols
+    }, index=index)
+
 def main():
     """
     Main function to load data, perform calculations, structure the table,
@@ -87,91 +121,110 @@ def main():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     csv_file_name = 'combinedbrfss_18_24v10.csv'
     data_file_path = os.path.join(script_dir, 'data', csv_file_name)
+    # Optional columnar copy of the same file (see README); preferred unless stale
+    parquet_file_path = os.path.splitext(data_file_path)[0] + '.parquet'
+
+    # Only the core columns are parsed, with their types fixed at read time.
+    # Nullable integers keep missing codes as <NA> until rows are dropped below.
+    # Weights are stored as float32 to halve memory; sums accumulate in float64.
+    core_dtypes = {
+        '_LLCPWT': 'float32',
+        'currentsmoker': 'Int8',
+        'URRU': 'Int8',
+        '_STATE': 'Int16',
+        'year_centered': 'Int8'
+    }
+
+    # Only 2018 and 2024 are tabulated, so other years are dropped while reading
+    year_labels = {-2: '2018', 4: '2024'}
+
+    # A Parquet copy older than the CSV is stale, so the CSV is read instead
+    use_parquet = os.path.exists(parquet_file_path)
+    if use_parquet and os.path.exists(data_file_path) and os.path.getmtime(parquet_file_path) < os.path.getmtime(data_file_path):
+        print(f"Warning: {os.path.basename(parquet_file_path)} is older than {csv_file_name}; reading the CSV instead (see README to regenerate it).")
+        use_parquet = False
 
-    print(f"Attempting to read CSV file: {data_file_path}...")
     try:
-        df = pd.read_csv(data_file_path)
-        print(f"Successfully read {csv_file_name}.")
+        if use_parquet:
+            print(f"Attempting to read Parquet file: {parquet_file_path}...")
+            df = pd.read_parquet(
+                parquet_file_path,
+                columns=list(core_dtypes),
+                filters=[('year_centered', 'in', list(year_labels))]
+            ).astype(core_dtypes)
+            print(f"Successfully read {os.path.basename(parquet_file_path)}.")
+        else:
+            print(f"Attempting to read CSV file: {data_file_path}...")
+            # Stream the CSV in chunks so only the two target years are held in memory
+            reader = pd.read_csv(data_file_path, usecols=list(core_dtypes), dtype=core_dtypes, chunksize=1_000_000)
+            df = pd.concat(
+                [chunk[chunk['year_centered'].isin(list(year_labels))] for chunk in reader],
+                ignore_index=True
+            )
+            print(f"Successfully read {csv_file_name}.")
     except FileNotFoundError:
         print(f"Error: CSV file not found at {data_file_path}")
         print(f"Please ensure you have run 'convert_to_csv.py' to generate '{csv_file_name}',")
         print(f"or that '{csv_file_name}' is in the same directory as this script.")
         return
     except Exception as e:
-        print(f"An error occurred while reading the CSV file: {e}")
+        print(f"An error occurred while reading the data file: {e}")
         return
 
-    # --- Ensure core columns exist and convert types ---
-    core_cols = {
-        '_LLCPWT': 'numeric',
-        'currentsmoker': 'numeric',
-        'URRU': 'numeric',
-        '_STATE': 'object',
-        'year_centered': 'numeric'
-    }
-
-    print("Performing data type conversions for core columns...")
-    for col, col_type in core_cols.items():
-        if col not in df.columns:
-            print(f"Error: Expected column '{col}' not found in the CSV file. Cannot proceed.")
-            return
-        if col_type == 'numeric':
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            if df[col].isnull().any():
-                print(f"Warning: Column '{col}' contained non-numeric values converted to NaN.")
-        elif col_type == 'object':
-            df[col] = df[col].astype(str)
-
-    if df['_LLCPWT'].isnull().all():
-        print("Error: All values in '_LLCPWT' are NaN after conversion. Check CSV data quality.")
-        return
-
-    if 'year_centered' in df.columns:
-        df.dropna(subset=['year_centered'], inplace=True)
-    else:
-        print("Error: 'year_centered' column is missing. Cannot proceed with year filtering.")
+    # An empty frame just means neither year is present; the per-year warnings cover it
+    if not df.empty and df['_LLCPWT'].isnull().all():
+        print("Error: All values in '_LLCPWT' are missing. Check CSV data quality.")
         return
 
     # --- 2. Filter Data for 2018 and 2024 ---
-    df_2018 = df[df['year_centered'] == -2].copy()
-    df_2024 = df[df['year_centered'] == 4].copy()
+    # The read above already kept only the two target years
+    year_counts = df['year_centered'].value_counts()
 
-    if df_2018.empty:
-        print("Warning: No data found for 2018 (year_centered == -2).")
-    else:
-        print(f"Filtered {len(df_2018)} records for 2018.")
-    if df_2024.empty:
-        print("Warning: No data found for 2024 (year_centered == 4).")
-    else:
-        print(f"Filtered {len(df_2024)} records for 2024.")
+    for year_value, year_label in year_labels.items():
+        if year_counts.get(year_value, 0) == 0:
+            print(f"Warning: No data found for {year_label} (year_centered == {year_value}).")
+        else:
+            print(f"Filtered {year_counts[year_value]} records for {year_label}.")
 
     key_calc_cols = ['_LLCPWT', 'currentsmoker', 'URRU', '_STATE']
-    df_2018.dropna(subset=key_calc_cols, inplace=True)
-    df_2024.dropna(subset=key_calc_cols, inplace=True)
+    # Complete rows can drop the nullable masks for plain NumPy integers
+    df_sub = df.dropna(subset=key_calc_cols).astype({
+        'currentsmoker': 'int8', 'URRU': 'int8', '_STATE': 'int16', 'year_centered': 'int8'
+    })
+    kept_counts = df_sub['year_centered'].value_counts()
 
-    if df_2018.empty and not df[df['year_centered'] == -2].empty:
-        print("Warning: All 2018 data dropped due to missing key columns.")
-    if df_2024.empty and not df[df['year_centered'] == 4].empty:
-        print("Warning: All 2024 data dropped due to missing key columns.")
+    for year_value, year_label in year_labels.items():
+        if kept_counts.get(year_value, 0) == 0 and year_counts.get(year_value, 0) > 0:
+            print(f"Warning: All {year_label} data dropped due to missing key columns.")
 
 
     # --- 3. Calculate prevalence & CI for each year/state/URRU ---
+    # Both years are aggregated in a single pass and split afterwards
+    df_sub['URRU_cat'] = df_sub['URRU'].map({0: 'Urban', 1: 'Rural'})
+    invalid_urru_years = set(df_sub.loc[df_sub['URRU_cat'].isnull(), 'year_centered'])
+
+    # Weighted sums per group; CI math is then vectorized over the small summary
+    df_sub['ws'] = df_sub['_LLCPWT'] * df_sub['currentsmoker']
+    df_sub['w2'] = df_sub['_LLCPWT']**2
+    group_sums = sum_by_group(df_sub, ['year_centered', '_STATE', 'URRU_cat'], ['_LLCPWT', 'ws', 'w2'])
+    summary_all = prevalence_ci_from_sums(group_sums)
+    summary_years = set(summary_all.index.get_level_values('year_centered'))
+
     processed_years = {}
-    for year_label, df_year_orig in [('2018', df_2018), ('2024', df_2024)]:
-        if df_year_orig.empty:
+    for year_value, year_label in year_labels.items():
+        if kept_counts.get(year_value, 0) == 0:
             print(f"Skipping calculations for {year_label} (no data).")
             processed_years[year_label] = pd.DataFrame()
             continue
 
         print(f"Processing data for {year_label}...")
-        df_year = df_year_orig.copy()
-        df_year['URRU'] = df_year['URRU'].astype(int)
-        df_year['URRU_cat'] = df_year['URRU'].map({0: 'Urban', 1: 'Rural'})
-
-        if df_year['URRU_cat'].isnull().any():
+        if year_value in invalid_urru_years:
             print(f"Warning: Some URRU values in {year_label} were not 0/1 and will be excluded.")
 
-        summary_df = df_year.groupby(['_STATE', 'URRU_cat']).apply(calculate_prevalence_ci).reset_index()
+        if year_value in summary_years:
+            summary_df = summary_all.xs(year_value, level='year_centered').reset_index()
+        else:
+            summary_df = pd.DataFrame()
         if summary_df.empty:
             print(f"No summary data generated for {year_label}.")
         else:
@@ -190,24 +243,14 @@ def main():
             final_yearly_data[year_label] = empty_df
             continue
 
-        pivot_df = summary_df.pivot_table(
-            index='_STATE',
-            columns='URRU_cat',
-            values=['prevalence', 'prevalence_ci_str'],
-            aggfunc='first'
-        ).reset_index()
+        # Each (state, URRU) pair is unique, so a plain reshape is enough
+        pivot_df = summary_df.set_index(['_STATE', 'URRU_cat'])[
+            ['prevalence', 'prevalence_ci_str']
+        ].unstack('URRU_cat')
 
         # Flatten MultiIndex columns
-        new_columns = []
-        for col in pivot_df.columns:
-            if isinstance(col, tuple):
-                if col[1] == '':
-                    new_columns.append(col[0])
-                else:
-                    new_columns.append(f"{col[0]}_{col[1]}")
-            else:
-                new_columns.append(col)
-        pivot_df.columns = new_columns
+        pivot_df.columns = [f"{value}_{ur_cat}" for value, ur_cat in pivot_df.columns]
+        pivot_df = pivot_df.reset_index()
 
         for ur_cat in ['Urban', 'Rural']:
             if f'prevalence_{ur_cat}' not in pivot_df.columns:
@@ -259,7 +302,7 @@ def main():
     final_table.reset_index(inplace=True)
     # Rename the index column to STATEFIPS
     final_table.rename(columns={'_STATE': 'STATEFIPS'}, inplace=True)
-    # Convert STATEFIPS from string to integer type for mapping to state names
+    # Ensure STATEFIPS is an integer type for mapping to state names
     final_table['STATEFIPS'] = pd.to_numeric(final_table['STATEFIPS'], errors='coerce').astype('Int64')
 
     # --- 6. Map STATEFIPS codes to state names ---
@@ -284,7 +327,13 @@ def main():
        78:  "Virgin Islands"
     }
 
-    final_table['State'] = final_table['STATEFIPS'].map(state_map)
+    # Lookup array indexed directly by FIPS code; unknown or missing codes map to None
+    state_names = np.full(max(state_map) + 1, None, dtype=object)
+    for fips, name in state_map.items():
+        state_names[fips] = name
+    fips_codes = final_table['STATEFIPS'].to_numpy(dtype=np.int64, na_value=0)
+    fips_codes[(fips_codes < 0) | (fips_codes >= len(state_names))] = 0
+    final_table['State'] = state_names[fips_codes]
     final_table.drop(columns=['STATEFIPS'], inplace=True)
 
     # Final column order
@@ -1,51 +1,59 @@
 import os
+import numpy as np
 import pandas as pd
 
-def create_descriptives(df, label, output_suffix):
+def codes_to_categorical(codes, label_map):
     """
-    Create descriptive statistics table with proper exclusion of missing smoking data.
+    Map integer BRFSS codes to a categorical of labels with one array lookup.
 
     Parameters:
-    - df: DataFrame with BRFSS data
-    - label: Description label (e.g., "2018-2023" or "2018-2024")
-    - output_suffix: Suffix for output filename (e.g., "_23" or "_24")
+    - codes: Series of integer codes (missing values allowed)
+    - label_map: Dict of code -> label; missing or unmapped codes become 'Missing'
+
+    Categories are sorted so grouped summaries keep alphabetical label order.
     """
+    categories = sorted(set(label_map.values()) | {'Missing'})
+    missing_code = categories.index('Missing')
+    low, high = min(label_map), max(label_map)
 
-    print("\n" + "=" * 80)
-    print(f"DESCRIPTIVE STATISTICS - BRFSS {label}")
-    print("Excludes missing smoking status from prevalence calculations")
-    print("=" * 80)
+    # Lookup table from (code - low) to category position
+    lookup = np.full(high - low + 1, missing_code, dtype=np.int8)
+    for code, label in label_map.items():
+        lookup[code - low] = categories.index(label)
 
-    # Total weighted sample size (ALL data)
-    total_weight_all = df['_LLCPWT'].sum()
+    values = codes.to_numpy(dtype='float64', na_value=np.nan)
+    in_range = (values >= low) & (values <= high) & (values == np.floor(values))
+    positions = np.where(in_range, values - low, 0).astype(np.intp)
+    return pd.Categorical.from_codes(np.where(in_range, lookup[positions], missing_code), categories=categories)
 
-    # Weighted sample with non-missing smoking status
-    df_smoking_valid = df[df['currentsmoker'].notna()].copy()
-    total_weight_valid_smoking = df_smoking_valid['_LLCPWT'].sum()
 
-    print(f"\nTotal records: {len(df):,}")
-    print(f"Total weighted sample (all): {total_weight_all:,.0f}")
-    print(f"Records with valid smoking status: {len(df_smoking_valid):,}")
-    print(f"Weighted sample (valid smoking): {total_weight_valid_smoking:,.0f}")
-    print(f"Missing smoking status: {len(df) - len(df_smoking_valid):,} ({(len(df) - len(df_smoking_valid))/len(df)*100:.1f}%)")
+def add_descriptive_columns(df):
+    """
+    Add the derived columns used by create_descriptives, in place.
+
+    Parameters:
+    - df: DataFrame with BRFSS data; derived once so subsets can share the columns
+    """
+    # Weighted smoking indicator (NaN where smoking status is missing)
+    df['_ws'] = df['_LLCPWT'] * df['currentsmoker'].astype('float64')
 
-    # Create categorical labels
-    df['URRU_cat'] = df['URRU'].map({0: 'Urban', 1: 'Rural'}).fillna('Missing')
+    # Create categorical labels (groupby then works on integer codes, not strings)
+    df['URRU_cat'] = codes_to_categorical(df['URRU'], {0: 'Urban', 1: 'Rural'})
 
     age_map = {
         1: '18-24', 2: '25-34', 3: '35-44',
         4: '45-54', 5: '55-64', 6: '65 or older'
     }
-    df['Age_cat'] = df['_AGE_G'].map(age_map).fillna('Missing')
+    df['Age_cat'] = codes_to_categorical(df['_AGE_G'], age_map)
 
-    df['Sex_cat'] = df['SEXVAR'].map({1: 'Male', 2: 'Female'}).fillna('Missing')
+    df['Sex_cat'] = codes_to_categorical(df['SEXVAR'], {1: 'Male', 2: 'Female'})
 
     race_map = {
         1: 'Non-Hispanic White', 2: 'Non-Hispanic Black',
         3: 'Non-Hispanic Other', 4: 'Non-Hispanic Multiracial',
         5: 'Hispanic', 9: 'Missing'
     }
-    df['Race_cat'] = df['_RACEGR3'].map(race_map).fillna('Missing')
+    df['Race_cat'] = codes_to_categorical(df['_RACEGR3'], race_map)
 
     edu_map = {
         1: 'Did not graduate high school',
@@ -54,13 +62,59 @@ def create_descriptives(df, label, output_suffix):
         4: 'Graduated from college or technical school',
         9: 'Missing'
     }
-    df['Edu_cat'] = df['_EDUCAG'].map(edu_map).fillna('Missing')
+    df['Edu_cat'] = codes_to_categorical(df['_EDUCAG'], edu_map)
 
     year_map = {
         -2: '2018', -1: '2019', 0: '2020', 1: '2021',
         2: '2022', 3: '2023', 4: '2024'
     }
-    df['Year_cat'] = df['year_centered'].map(year_map).fillna('Missing')
+    df['Year_cat'] = codes_to_categorical(df['year_centered'], year_map)
+
+
+def create_descriptives(df, label, output_suffix, total_weight_all=None):
+    """
+    Create descriptive statistics table with proper exclusion of missing smoking data.
+
+    Parameters:
+    - df: DataFrame with BRFSS data
+    - label: Description label (e.g., "2018-2023" or "2018-2024")
+    - output_suffix: Suffix for output filename (e.g., "_23" or "_24")
+    - total_weight_all: Total weighted sample size; computed from df when omitted
+
+    df must already carry the columns from add_descriptive_columns and is not modified.
+    """
+
+    print("\n" + "=" * 80)
+    print(f"DESCRIPTIVE STATISTICS - BRFSS {label}")
+    print("Excludes missing smoking status from prevalence calculations")
+    print("=" * 80)
+
+    # Total weighted sample size (ALL data)
+    if total_weight_all is None:
+        total_weight_all = df['_LLCPWT'].sum()
+
+    characteristics = [
+        ('Urban/Rural', 'URRU_cat'),
+        ('Age', 'Age_cat'),
+        ('Sex', 'Sex_cat'),
+        ('Race/Ethnicity', 'Race_cat'),
+        ('Education', 'Edu_cat'),
+        ('Year', 'Year_cat'),
+    ]
+
+    # Weighted sample with non-missing smoking status; prevalence sums only scan these rows
+    df_smoking_valid = df.loc[
+        df['currentsmoker'].notna(),
+        ['_LLCPWT', '_ws'] + [col_name for _, col_name in characteristics]
+    ]
+    n_smoking_valid = len(df_smoking_valid)
+    total_weight_valid_smoking = df_smoking_valid['_LLCPWT'].sum()
+
+    print(f"\nTotal records: {len(df):,}")
+    print(f"Total weighted sample (all): {total_weight_all:,.0f}")
+    print(f"Records with valid smoking status: {n_smoking_valid:,}")
+    print(f"Weighted sample (valid smoking): {total_weight_valid_smoking:,.0f}")
+    print(f"Missing smoking status: {len(df) - n_smoking_valid:,} ({(len(df) - n_smoking_valid)/len(df)*100:.1f}%)")
 
     # Function to compute summary - EXCLUDES MISSING FROM BOTH NUMERATOR AND DENOMINATOR
     def summarize(col_name):
@@ -68,59 +122,28 @@ def create_descriptives(df, label, output_suffix):
         Compute weighted sample size, percentage, and smoking prevalence.
         EXCLUDES missing smoking status from prevalence calculation (both numerator and denominator).
         """
-        grouped = df.groupby(col_name).apply(
-            lambda g: pd.Series({
-                'Weighted sample size (all)': g['_LLCPWT'].sum(),
-                'Percentage (of all)': g['_LLCPWT'].sum() / total_weight_all * 100,
-                'Weighted sample (valid smoking)': g[g['currentsmoker'].notna()]['_LLCPWT'].sum(),
-                'Smoking prevalence': (
-                    (g[g['currentsmoker'].notna()]['_LLCPWT'] * g[g['currentsmoker'].notna()]['currentsmoker']).sum() /
-                    g[g['currentsmoker'].notna()]['_LLCPWT'].sum() * 100
-                    if g[g['currentsmoker'].notna()]['_LLCPWT'].sum() > 0 else 0
-                )
-            }),
-            include_groups=False
-        ).reset_index()
-        grouped.columns = [col_name, 'Weighted sample size (all)', 'Percentage (of all)',
-                          'Weighted sample (valid smoking)', 'Smoking prevalence']
+        # weight_all keeps sorted keys since it fixes the table row order; the
+        # valid sums are realigned to it below, so their key order is irrelevant
+        weight_all = df.groupby(col_name, observed=True)['_LLCPWT'].sum()
+        valid_sums = df_smoking_valid.groupby(col_name, observed=True, sort=False)[['_LLCPWT', '_ws']].sum()
+        # Categories with no valid smoking records get zero sums (and 0 prevalence)
+        valid_sums = valid_sums.reindex(weight_all.index, fill_value=0)
+        grouped = pd.DataFrame({
+            'Weighted sample size (all)': weight_all,
+            'Percentage (of all)': weight_all / total_weight_all * 100,
+            'Weighted sample (valid smoking)': valid_sums['_LLCPWT'],
+            'Smoking prevalence': (valid_sums['_ws'] / valid_sums['_LLCPWT'] * 100).where(valid_sums['_LLCPWT'] > 0, 0)
+        }).reset_index()
         return grouped
 
     # Generate summaries
-    urban_rural_summary = summarize('URRU_cat')
-    age_summary        = summarize('Age_cat')
-    sex_summary        = summarize('Sex_cat')
-    race_summary       = summarize('Race_cat')
-    edu_summary        = summarize('Edu_cat')
-    year_summary       = summarize('Year_cat')
-
-    print("\n=== Urban/Rural ===")
-    print(urban_rural_summary.to_string(index=False))
-
-    print("\n=== Age ===")
-    print(age_summary.to_string(index=False))
-
-    print("\n=== Sex ===")
-    print(sex_summary.to_string(index=False))
-
-    print("\n=== Race/Ethnicity ===")
-    print(race_summary.to_string(index=False))
-
-    print("\n=== Education ===")
-    print(edu_summary.to_string(index=False))
+    summaries = [(name, summarize(col_name)) for name, col_name in characteristics]
 
-    print("\n=== Year ===")
-    print(year_summary.to_string(index=False))
+    for name, df_sum in summaries:
+        print(f"\n=== {name} ===")
+        print(df_sum.to_string(index=False))
 
     # Combine all summaries
-    summaries = [
-        ('Urban/Rural', urban_rural_summary),
-        ('Age', age_summary),
-        ('Sex', sex_summary),
-        ('Race/Ethnicity', race_summary),
-        ('Education', edu_summary),
-        ('Year', year_summary),
-    ]
-
     combined_dfs = []
     for name, df_sum in summaries:
         df2 = df_sum.copy()
@@ -156,33 +179,59 @@ if __name__ == '__main__':
     output_dir = os.path.join(script_dir, 'output')
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    df_all = pd.read_csv(data_file)
+
+    # Parse only the columns used for the descriptives, typed at read time
+    descriptive_dtypes = {
+        '_LLCPWT': 'float64',
+        'currentsmoker': 'Int8',
+        'URRU': 'Int8',
+        '_AGE_G': 'Int8',
+        'SEXVAR': 'Int8',
+        '_RACEGR3': 'Int8',
+        '_EDUCAG': 'Int8',
+        'year_centered': 'Int8'
+    }
+    # Prefer the optional Parquet copy of the combined file (see README) unless it is
+    # older than the CSV, i.e. stale
+    parquet_file = os.path.splitext(display_path)[0] + '.parquet'
+    use_parquet = os.path.exists(parquet_file)
+    if use_parquet and os.path.exists(display_path) and os.path.getmtime(parquet_file) < os.path.getmtime(display_path):
+        print(f"Warning: {os.path.basename(parquet_file)} is older than {os.path.basename(display_path)}; reading the CSV instead (see README to regenerate it).")
+        use_parquet = False
+    if use_parquet:
+        data_file = parquet_file
+        df_all = pd.read_parquet(data_file, columns=list(descriptive_dtypes)).astype(descriptive_dtypes)
+    else:
+        df_all = pd.read_csv(data_file, usecols=list(descriptive_dtypes), dtype=descriptive_dtypes)
 
     print("=" * 80)
     print("CREATING DESCRIPTIVE STATISTICS WITH PROPER MISSING DATA EXCLUSION")
     print("=" * 80)
     print(f"\nLoaded: {data_file}")
     print(f"Total records: {len(df_all):,}")
-    print(f"Years: {sorted(df_all['year_centered'].unique())}")
+    print(f"Years: {sorted(df_all['year_centered'].dropna().unique())}")
+
+    # Derive labels and masked weights once; both runs read them without copying df_all
+    add_descriptive_columns(df_all)
 
     # Create 2018-2023 subset
-    df_23 = df_all[df_all['year_centered'].isin([-2, -1, 0, 1, 2, 3])].copy()
+    df_23 = df_all[df_all['year_centered'].isin([-2, -1, 0, 1, 2, 3])]
     print(f"\n2018-2023 subset: {len(df_23):,} records")
 
     # Create 2018-2024 dataset (all data)
-    df_24 = df_all.copy()
+    df_24 = df_all
     print(f"2018-2024 dataset: {len(df_24):,} records")
 
     # Generate both versions
     print("\n" + "=" * 80)
     print("GENERATING 2018-2023 DESCRIPTIVES")
     print("=" * 80)
-    result_23 = create_descriptives(df_23, "2018-2023", "_23")
+    result_23 = create_descriptives(df_23, "2018-2023", "_23", df_23['_LLCPWT'].sum())
 
     print("\n" + "=" * 80)
     print("GENERATING 2018-2024 DESCRIPTIVES")
     print("=" * 80)
-    result_24 = create_descriptives(df_24, "2018-2024", "_24")
+    result_24 = create_descriptives(df_24, "2018-2024", "_24", df_24['_LLCPWT'].sum())
 
     # Print comparison
     print("\n" + "=" * 80)
@@ -2,26 +2,20 @@ import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
 
-def parse_p(val):
-    """Parse p-value, handling '<' character and scientific notation."""
-    try:
-        if pd.isna(val):
-            return np.nan
-        if isinstance(val, str):
-            if val.startswith('<'):
-                return float(val.strip('<'))
-            # Handle scientific notation like "1.82335E-124"
-            return float(val)
-        return float(val)
-    except (ValueError, TypeError):
-        return np.nan
+def parse_p_series(values):
+    """Parse a column of p-values, handling '<' prefixes and scientific notation."""
+    # e.g. "<.0001" -> 0.0001 and "1.82335E-124" -> 1.82335e-124; anything else -> NaN
+    return pd.to_numeric(values.astype(str).str.strip().str.lstrip('<'), errors='coerce')
 
 
-def get_or_category(row, q1, q2):
-    """Categorize state based on odds ratio and significance.
+def get_or_category(present, odds_ratio, p, q1, q2):
+    """Categorize states based on odds ratio and significance.
 
     Separation rules:
     - Rural sample size: n < 50 when the state is absent from logistic_or_by_state_v17.csv
@@ -29,18 +23,51 @@ def get_or_category(row, q1, q2):
     - OR < 1.0: significant with OR < 1.0
     - Otherwise, use OR thresholds for rural > urban
     """
-    # Check if state is not in the results file (insufficient rural sample)
-    if not row['present_in_results']:
-        return 'Rural sample size: n < 50'
-    if pd.isna(row['OR']) or pd.isna(row['p']) or row['p'] >= 0.05:
-        return 'Non-significant'
-    if row['OR'] < 1.0:
-        return 'OR < 1.0'
-    if row['OR'] <= 1.25:
-        return 'OR ≤ 1.25'
-    if row['OR'] < 1.5:
-        return '1.25 < OR < 1.50'
-    return 'OR ≥ 1.50'
+    significant = present & odds_ratio.notna() & p.notna() & (p < 0.05)
+
+    # np.select takes the first matching rule, mirroring the order above
+    conditions = [
+        ~present,
+        ~significant,
+        odds_ratio < 1.0,
+        odds_ratio <= 1.25,
+        odds_ratio < 1.5,
+    ]
+    choices = [
+        'Rural sample size: n < 50',
+        'Non-significant',
+        'OR < 1.0',
+        'OR ≤ 1.25',
+        '1.25 < OR < 1.50',
+    ]
+    return pd.Series(np.select(conditions, choices, default='OR ≥ 1.50'), index=present.index)
+
+
+def geometry_paths(gdf):
+    """Convert (Multi)Polygon geometries to matplotlib Paths, one compound path per row.
+
+    Also returns the aspect ratio GeoDataFrame.plot uses for geographic coordinates,
+    so the shapes can be redrawn on several axes without repeating the conversion.
+    """
+    paths = []
+    for geom in gdf.geometry:
+        parts = [geom] if geom.geom_type == 'Polygon' else geom.geoms
+        rings = []
+        for part in parts:
+            rings.append(Path(np.asarray(part.exterior.coords)[:, :2], closed=True))
+            rings.extend(Path(np.asarray(ring.coords)[:, :2], closed=True) for ring in part.interiors)
+        paths.append(Path.make_compound_path(*rings))
+
+    bounds = gdf.total_bounds
+    aspect = 1 / np.cos(np.mean([bounds[1], bounds[3]]) * np.pi / 180)
+    return paths, aspect
+
+
+def plot_paths(ax, paths, aspect, colors, **kwargs):
+    """Draw precomputed geometry paths filled with per-row colors, like GeoDataFrame.plot."""
+    ax.set_aspect(aspect)
+    ax.add_collection(PatchCollection([PathPatch(path) for path in paths], facecolor=list(colors), **kwargs))
+    ax.autoscale_view()
 
 
 def main():
@@ -51,7 +78,10 @@ def main():
     gdf = gpd.read_file('us-states.json')
 
     # Prepare data
-    rural_counts = dfr[dfr['URRU'] == 1].groupby('_STATE').size()
+    # Rural records per state; FIPS codes are small integers, so bincount indexes them directly
+    # (records with a missing _STATE are skipped, as groupby would)
+    rural_states = dfr.loc[(dfr['URRU'] == 1) & dfr['_STATE'].notna(), '_STATE'].to_numpy(dtype=np.intp)
+    rural_counts = pd.Series(np.bincount(rural_states)).rename_axis('_STATE')
     df['_STATE'] = df['State_Code'].astype(int)
     df['rural_n'] = df['_STATE'].map(rural_counts).fillna(0).astype(int)
 
@@ -93,6 +123,38 @@ def main():
         'Rural sample size: n < 50': '#969696',  # darker grey
         'OR < 1.0': '#fee090',  # yellow/cream (opposite of rural higher)
     }
+    or_colors = {
+        'OR ≤ 1.25': '#a6bddb',
+        '1.25 < OR < 1.50': '#3690c0',
+        'OR ≥ 1.50': '#034e7b'
+    }
+    model_colors = {**base_colors, **or_colors}
+
+    # Compute OR, p, category and color for every model once, as side columns
+    for m, (title, or_col, p_col) in enumerate(models, start=1):
+        gdf[f'OR_m{m}'] = pd.to_numeric(gdf[or_col], errors='coerce')
+        gdf[f'p_m{m}'] = parse_p_series(gdf[p_col])
+
+        # Calculate quartiles for significant ORs (only for states present in results with OR >= 1)
+        mask_sig = (gdf[f'p_m{m}'] < 0.05) & gdf['present_in_results'] & gdf[f'OR_m{m}'].notna() & (gdf[f'OR_m{m}'] >= 1.0)
+        or_sig = gdf.loc[mask_sig, f'OR_m{m}']
+        if not or_sig.empty:
+            q1, q2 = np.percentile(or_sig, [33.33, 66.67])
+        else:
+            q1 = q2 = np.nan
+
+        # Assign categories and map them to colors
+        gdf[f'category_m{m}'] = get_or_category(gdf['present_in_results'], gdf[f'OR_m{m}'], gdf[f'p_m{m}'], q1=q1, q2=q2)
+        gdf[f'color_m{m}'] = gdf[f'category_m{m}'].map(model_colors).fillna('white')
+
+    # Region subsets are the same for every model
+    gdf_conus = gdf[~gdf['State'].isin(['Alaska', 'Hawaii'])]
+    gdf_ak = gdf[gdf['State'] == 'Alaska']
+    gdf_hi = gdf[gdf['State'] == 'Hawaii']
+
+    # Inset shapes never change between models; convert them to paths once
+    ak_paths, ak_aspect = geometry_paths(gdf_ak)
+    hi_paths, hi_aspect = geometry_paths(gdf_hi)
 
     fig = plt.figure(figsize=(20, 15))
     gs = fig.add_gridspec(2, 2)
@@ -105,34 +167,11 @@ def main():
 
     for i, (title, or_col, p_col) in enumerate(models):
         ax = axes[i]
-        gdf['OR'] = pd.to_numeric(gdf[or_col], errors='coerce')
-        gdf['p'] = gdf[p_col].apply(parse_p)
-
-        # Calculate quartiles for significant ORs (only for states present in results with OR >= 1)
-        mask_sig = (gdf['p'] < 0.05) & gdf['present_in_results'] & gdf['OR'].notna() & (gdf['OR'] >= 1.0)
-        or_sig = gdf.loc[mask_sig, 'OR']
-        if not or_sig.empty:
-            q1, q2 = np.percentile(or_sig, [33.33, 66.67])
-        else:
-            q1 = q2 = np.nan
-
-        # Assign categories
-        gdf['category'] = gdf.apply(get_or_category, axis=1, q1=q1, q2=q2)
-
-        # Define colors for this model
-        or_colors = {
-            'OR ≤ 1.25': '#a6bddb',
-            '1.25 < OR < 1.50': '#3690c0',
-            'OR ≥ 1.50': '#034e7b'
-        }
-        model_colors = {**base_colors, **or_colors}
-
-        # Map colors to categories
-        gdf['plot_color'] = gdf['category'].map(model_colors).fillna('white')
+        color_col = f'color_m{i + 1}'
 
         # Plot continental US
-        gdf[~gdf['State'].isin(['Alaska', 'Hawaii'])].plot(
-            color=gdf[~gdf['State'].isin(['Alaska', 'Hawaii'])]['plot_color'],
+        gdf_conus.plot(
+            color=gdf_conus[color_col],
             legend=False,
             linewidth=0.8,
             ax=ax,
@@ -143,12 +182,7 @@ def main():
 
         # Plot Alaska
         ax_ak = inset_axes(ax, width="25%", height="25%", loc='lower left', borderpad=0)
-        gdf[gdf['State'] == 'Alaska'].plot(
-            color=gdf[gdf['State'] == 'Alaska']['plot_color'],
-            legend=False,
-            ax=ax_ak,
-            edgecolor='0.8'
-        )
+        plot_paths(ax_ak, ak_paths, ak_aspect, gdf_ak[color_col], edgecolor='0.8')
         ax_ak.set_axis_off()
 
         # Plot Hawaii
@@ -161,12 +195,7 @@ def main():
             bbox_transform=ax.transAxes,
             borderpad=0
         )
-        gdf[gdf['State'] == 'Hawaii'].plot(
-            color=gdf[gdf['State'] == 'Hawaii']['plot_color'],
-            legend=False,
-            ax=ax_hi,
-            edgecolor='0.8'
-        )
+        plot_paths(ax_hi, hi_paths, hi_aspect, gdf_hi[color_col], edgecolor='0.8')
         ax_hi.set_axis_off()
 
     # Create a single legend for the figure
@@ -197,19 +226,14 @@ def main():
 
     # Print states with OR < 1.0
     print("\nStates with OR < 1.0 by model:")
-    for title, or_col, p_col in models:
-        gdf['OR'] = pd.to_numeric(gdf[or_col], errors='coerce')
-        gdf['p'] = gdf[p_col].apply(parse_p)
-        gdf['category'] = gdf.apply(get_or_category, axis=1, q1=1.25, q2=1.5)
-
-        urban_higher = gdf[(gdf['category'] == 'OR < 1.0') & (gdf['State'] != 'Nationwide')]
+    for m, (title, or_col, p_col) in enumerate(models, start=1):
+        urban_higher = gdf[(gdf[f'category_m{m}'] == 'OR < 1.0') & (gdf['State'] != 'Nationwide')]
         if len(urban_higher) > 0:
             print(f"\n{title}:")
             for idx, row in urban_higher.iterrows():
-                print(f"  {row['State']}: OR = {row['OR']:.3f}, p = {row['p']:.4f}")
+                print(f"  {row['State']}: OR = {row[f'OR_m{m}']:.3f}, p = {row[f'p_m{m}']:.4f}")
         else:
             print(f"\n{title}: None")
 
-
 if __name__ == '__main__':
     main()
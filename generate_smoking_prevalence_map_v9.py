@@ -1,63 +1,181 @@
+import os
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import numpy as np
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 
 
-def calculate_metrics(group):
+def calculate_metrics(sums):
     """
-    Calculates prevalence, sample size, and RSE for a given data group.
+    Calculates prevalence, sample size, and RSE from per-group sums of
+    weighted smokers (ws), weights (tw), squared weights (sw2) and records (n).
     """
-    n = len(group)
-    weighted_smokers = (group['currentsmoker'] * group['_LLCPWT']).sum()
-    total_weight = group['_LLCPWT'].sum()
+    has_weight = (sums['tw'] != 0) & (sums['n'] != 0)
+    prevalence = (sums['ws'] / sums['tw']).where(has_weight)
 
-    if total_weight == 0 or n == 0:
-        return pd.Series({'prevalence': np.nan, 'n': n, 'rse': np.nan})
+    n_eff = (sums['tw']**2 / sums['sw2']).where(sums['sw2'] > 0, 0)
+    has_rse = (n_eff != 0) & (prevalence > 0) & (prevalence < 1)
+    se = np.sqrt((prevalence * (1 - prevalence)) / n_eff.where(has_rse))
+    rse = (se / prevalence) * 100
 
-    prevalence = weighted_smokers / total_weight
-    sum_weights_sq = (group['_LLCPWT']**2).sum()
-    n_eff = (total_weight**2) / sum_weights_sq if sum_weights_sq > 0 else 0
+    return pd.DataFrame({'prevalence': prevalence, 'n': sums['n'].astype(int), 'rse': rse})
 
-    if n_eff == 0 or prevalence <= 0 or prevalence >= 1:
-        rse = np.nan
-    else:
-        se = np.sqrt((prevalence * (1 - prevalence)) / n_eff)
-        rse = (se / prevalence) * 100
 
-    return pd.Series({'prevalence': prevalence, 'n': int(n), 'rse': rse})
+def geometry_paths(gdf):
+    """Convert (Multi)Polygon geometries to matplotlib Paths, one compound path per row.
 
+    Also returns the aspect ratio GeoDataFrame.plot uses for geographic coordinates,
+    so the shapes can be redrawn on several axes without repeating the conversion.
+    """
+    paths = []
+    for geom in gdf.geometry:
+        parts = [geom] if geom.geom_type == 'Polygon' else geom.geoms
+        rings = []
+        for part in parts:
+            rings.append(Path(np.asarray(part.exterior.coords)[:, :2], closed=True))
+            rings.extend(Path(np.asarray(ring.coords)[:, :2], closed=True) for ring in part.interiors)
+        paths.append(Path.make_compound_path(*rings))
 
-def main():
-    # --- 1. Load Data ---
-    df = pd.read_csv('data/combinedbrfss_18_24v10.csv')
-    gdf = gpd.read_file('us-states.json')
+    bounds = gdf.total_bounds
+    aspect = 1 / np.cos(np.mean([bounds[1], bounds[3]]) * np.pi / 180)
+    return paths, aspect
 
-    # --- 2. Prepare Data & Calculate Metrics ---
-    year_map = {-2: 2018, 4: 2024}
-    df['year'] = df['year_centered'].map(year_map)
-    df = df[df['year'].isin([2018, 2024])].copy()
 
-    for col in ['_LLCPWT', 'currentsmoker', 'URRU', '_STATE', 'year']:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    df.dropna(subset=['_LLCPWT', 'currentsmoker', 'URRU', '_STATE', 'year'], inplace=True)
+def plot_value_paths(ax, paths, aspect, values, cmap, vmin, vmax, missing_color, **kwargs):
+    """Draw precomputed geometry paths colored by value, like GeoDataFrame.plot(column=...).
+
+    Rows with a NaN value are filled with missing_color, as missing_kwds does.
+    """
+    ax.set_aspect(aspect)
+    missing = np.isnan(values)
+    if not missing.all():
+        collection = PatchCollection([PathPatch(path) for path, m in zip(paths, missing) if not m], cmap=cmap, **kwargs)
+        collection.set_array(values[~missing])
+        collection.set_clim(vmin, vmax)
+        ax.add_collection(collection)
+    if missing.any():
+        ax.add_collection(PatchCollection([PathPatch(path) for path, m in zip(paths, missing) if m], facecolor=missing_color, **kwargs))
+    ax.autoscale_view()
+
+
+def compute_final_metrics(data_file):
+    """
+    Read the 2018 and 2024 records from the combined file (CSV or Parquet) and return
+    per state, year and URRU the prevalence (NaN where unreliable), n and RSE.
+    """
+    # Only the five columns used for the metrics are parsed, typed at read time
+    # (nullable integers keep missing codes as <NA> until rows are dropped below)
+    metric_dtypes = {
+        'year_centered': 'Int8',
+        '_LLCPWT': 'float32',
+        'currentsmoker': 'Int8',
+        'URRU': 'Int8',
+        '_STATE': 'Int16'
+    }
+    # Only 2018 and 2024 are mapped, so other years are dropped while reading
+    year_map = {-2: 2018, 4: 2024}
+    if data_file.endswith('.parquet'):
+        df = pd.read_parquet(
+            data_file,
+            columns=list(metric_dtypes),
+            filters=[('year_centered', 'in', list(year_map))]
+        ).astype(metric_dtypes)
+    else:
+        # Stream the CSV in chunks so only the two target years are held in memory
+        reader = pd.read_csv(data_file, usecols=list(metric_dtypes), dtype=metric_dtypes, chunksize=1_000_000)
+        df = pd.concat([chunk[chunk['year_centered'].isin(list(year_map))] for chunk in reader], ignore_index=True)
 
-    metrics = df.groupby(['_STATE', 'year', 'URRU']).apply(calculate_metrics).reset_index()
+    # --- 2. Prepare Data & Calculate Metrics ---
+    # Keep rows with all metric columns present and finite
+    key_calc_cols = ['_LLCPWT', 'currentsmoker', 'URRU', '_STATE']
+    complete = np.isfinite(df[key_calc_cols].to_numpy(dtype=np.float32, na_value=np.nan)).all(axis=1)
+    df = df[complete].astype({'year_centered': 'int8', 'currentsmoker': 'int8', 'URRU': 'int8', '_STATE': 'int16'})
+    # With only the two mapped years left, the label is a single vectorized choice
+    df['year'] = np.where(df['year_centered'].to_numpy() == -2, year_map[-2], year_map[4]).astype(np.int16)
+
+    # Group keys and weighted sums only
+    # Weights are stored as float32; products and sums accumulate in float64
+    weights = df['_LLCPWT'].to_numpy(dtype=np.float64)
+    df = pd.DataFrame({
+        '_STATE': df['_STATE'].to_numpy(),
+        'year': df['year'].to_numpy(),
+        'URRU': df['URRU'].to_numpy(),
+        'ws': weights * df['currentsmoker'].to_numpy(),
+        'tw': weights,
+        'sw2': np.square(weights)
+    })
+    grouped = df.groupby(['_STATE', 'year', 'URRU'])
+    # Per-group sums and record counts
+    sums = grouped[['ws', 'tw', 'sw2']].sum()
+    sums['n'] = grouped.size()
+    metrics = calculate_metrics(sums).reset_index()
 
     # --- 3. Flag Unreliable Data ---
     # Exclude estimates where RSE > 30% or unweighted sample size < 50
-    metrics['is_unreliable'] = (metrics['n'] < 50) | (metrics['rse'] > 30)
-
-    # Build final dataset using observed 2018 and 2024 only
-    final_metrics = metrics[metrics['year'].isin([2018, 2024])].copy()
+    is_unreliable = (metrics['n'].to_numpy() < 50) | (metrics['rse'].to_numpy() > 30)
+    metrics['is_unreliable'] = is_unreliable
     # Drop prevalence where unreliable to prevent misinterpretation
-    final_metrics.loc[final_metrics['is_unreliable'], 'prevalence'] = np.nan
+    metrics['prevalence'] = np.where(is_unreliable, np.nan, metrics['prevalence'].to_numpy())
+
+    return metrics
+
+
+def main():
+    # --- 1. Load Data ---
+    # Prefer the optional Parquet copy of the combined file (see README) unless it is
+    # older than the CSV, i.e. stale
+    csv_file = 'data/combinedbrfss_18_24v10.csv'
+    data_file = 'data/combinedbrfss_18_24v10.parquet'
+    if not os.path.exists(data_file):
+        data_file = csv_file
+    elif os.path.exists(csv_file) and os.path.getmtime(data_file) < os.path.getmtime(csv_file):
+        print(f"Warning: {os.path.basename(data_file)} is older than {os.path.basename(csv_file)}; reading the CSV instead (see README to regenerate it).")
+        data_file = csv_file
+    # Reuse the metrics saved by an earlier run while they are newer than both the
+    # data file and this script; otherwise recompute them and refresh the cache
+    metrics_cache = 'data/prevalence_map_metrics_v9.pkl'
+    if os.path.exists(metrics_cache) and os.path.getmtime(metrics_cache) >= max(
+            os.path.getmtime(data_file), os.path.getmtime(__file__)):
+        final_metrics = pd.read_pickle(metrics_cache)
+    else:
+        final_metrics = compute_final_metrics(data_file)
+        final_metrics.to_pickle(metrics_cache)
+
+    # Reuse a Feather copy of the state shapes while it is newer than the GeoJSON;
+    # writing it needs the optional pyarrow package, so the GeoJSON remains the fallback
+    geo_cache = 'data/us-states.feather'
+    if os.path.exists(geo_cache) and os.path.getmtime(geo_cache) >= os.path.getmtime('us-states.json'):
+        gdf = gpd.read_feather(geo_cache)
+    else:
+        gdf = gpd.read_file('us-states.json')
+        try:
+            gdf.to_feather(geo_cache)
+        except ImportError:
+            pass
 
     # --- 4. Merge with GeoDataFrame ---
     gdf = gdf.rename(columns={'name': 'State'})
     state_fips_map = {1:"Alabama",2:"Alaska",4:"Arizona",5:"Arkansas",6:"California",8:"Colorado",9:"Connecticut",10:"Delaware",11:"District of Columbia",12:"Florida",13:"Georgia",15:"Hawaii",16:"Idaho",17:"Illinois",18:"Indiana",19:"Iowa",20:"Kansas",21:"Kentucky",22:"Louisiana",23:"Maine",24:"Maryland",25:"Massachusetts",26:"Michigan",27:"Minnesota",28:"Mississippi",29:"Missouri",30:"Montana",31:"Nebraska",32:"Nevada",33:"New Hampshire",34:"New Jersey",35:"New Mexico",36:"New York",37:"North Carolina",38:"North Dakota",39:"Ohio",40:"Oklahoma",41:"Oregon",42:"Pennsylvania",44:"Rhode Island",45:"South Carolina",46:"South Dakota",47:"Tennessee",48:"Texas",49:"Utah",50:"Vermont",51:"Virginia",53:"Washington",54:"West Virginia",55:"Wisconsin",56:"Wyoming"}
-    final_metrics['State'] = final_metrics['_STATE'].map(state_fips_map)
+    # Lookup array indexed directly by FIPS code; territories and unknown codes map to None
+    state_names = np.full(max(state_fips_map) + 1, None, dtype=object)
+    for fips, name in state_fips_map.items():
+        state_names[fips] = name
+    fips_codes = final_metrics['_STATE'].to_numpy(dtype=np.intp)
+    fips_codes[(fips_codes < 0) | (fips_codes >= len(state_names))] = 0
+    final_metrics['State'] = state_names[fips_codes]
+
+    # One prevalence column per (year, URRU) panel, joined onto the geometry once
+    panel_keys = pd.MultiIndex.from_product([[2018, 2024], [0, 1]], names=['year', 'URRU'])
+    wide = (final_metrics.dropna(subset=['State'])
+            .set_index(['State', 'year', 'URRU'])['prevalence']
+            .unstack(['year', 'URRU'])
+            .reindex(columns=panel_keys))
+    wide.columns = [f'prevalence_{year}_{urru}' for year, urru in wide.columns]
+    gdf = gdf.join(wide, on='State')
 
     # --- 5. Create the Plot ---
     fig, axes = plt.subplots(2, 2, figsize=(20, 12), sharex=True, sharey=True)
@@ -67,22 +185,30 @@ def main():
     }
     vmin, vmax = 0.05, 0.30
 
+    # Region subsets are the same for every panel
+    gdf_conus = gdf[~gdf['State'].isin(['Alaska', 'Hawaii'])]
+    gdf_ak = gdf[gdf['State'] == 'Alaska']
+    gdf_hi = gdf[gdf['State'] == 'Hawaii']
+
+    # Shapes never change between panels; convert them to paths once and only recolor
+    conus_paths, conus_aspect = geometry_paths(gdf_conus)
+    ak_paths, ak_aspect = geometry_paths(gdf_ak)
+    hi_paths, hi_aspect = geometry_paths(gdf_hi)
+
     for (row, col), panel_info in panels.items():
         ax = axes[row, col]
-        data_plot = final_metrics[(final_metrics['year'] == panel_info['year']) & (final_metrics['URRU'] == panel_info['urru'])]
-        merged_gdf = gdf.merge(data_plot, on='State', how='left')
+        column = f"prevalence_{panel_info['year']}_{panel_info['urru']}"
 
-        merged_gdf[~merged_gdf['State'].isin(['Alaska', 'Hawaii'])].plot(
-            column='prevalence', cmap='RdYlGn_r', linewidth=0.8, ax=ax, edgecolor='0.8',
-            vmin=vmin, vmax=vmax, missing_kwds={"color": "lightgrey"})
+        plot_value_paths(ax, conus_paths, conus_aspect, gdf_conus[column].to_numpy(dtype=float), 'RdYlGn_r', vmin, vmax,
+                         'lightgrey', linewidth=0.8, edgecolor='0.8')
         ax.set_axis_off()
 
         ax_ak = ax.inset_axes([0.05, 0.0, 0.25, 0.25])
-        merged_gdf[merged_gdf['State'] == 'Alaska'].plot(column='prevalence', cmap='RdYlGn_r', ax=ax_ak, vmin=vmin, vmax=vmax, missing_kwds={"color": "lightgrey"})
+        plot_value_paths(ax_ak, ak_paths, ak_aspect, gdf_ak[column].to_numpy(dtype=float), 'RdYlGn_r', vmin, vmax, 'lightgrey')
         ax_ak.set_axis_off()
 
         ax_hi = ax.inset_axes([0.3, 0.0, 0.2, 0.2])
-        merged_gdf[merged_gdf['State'] == 'Hawaii'].plot(column='prevalence', cmap='RdYlGn_r', ax=ax_hi, vmin=vmin, vmax=vmax, missing_kwds={"color": "lightgrey"})
+        plot_value_paths(ax_hi, hi_paths, hi_aspect, gdf_hi[column].to_numpy(dtype=float), 'RdYlGn_r', vmin, vmax, 'lightgrey')
         ax_hi.set_axis_off()
 
     # --- 6. Titles and Labels ---
@@ -110,11 +236,12 @@ def main():
 
     # Print summary statistics
     print("\n=== Data Quality Summary ===")
+    # State counts for every (year, URRU) cell in one grouped pass; count skips the NaN estimates
+    state_counts = (final_metrics.groupby(['year', 'URRU'])['prevalence'].agg(['size', 'count'])
+                    .reindex(panel_keys, fill_value=0))
     for year in [2018, 2024]:
         for urru_val, urru_name in [(0, 'Urban'), (1, 'Rural')]:
-            subset = final_metrics[(final_metrics['year'] == year) & (final_metrics['URRU'] == urru_val)]
-            total_states = len(subset)
-            reliable_states = subset['prevalence'].notna().sum()
+            total_states, reliable_states = state_counts.loc[(year, urru_val)]
             unreliable_states = total_states - reliable_states
             print(f"{year} {urru_name}: {reliable_states}/{total_states} states with reliable estimates ({unreliable_states} excluded)")
 